@@ -1,55 +1,299 @@
 # main.py
-import json
+import csv
+import gzip
+import heapq
+from bisect import bisect_right
+import mmap
+import orjson
+import os
+import redis
+import threading
+import time
 import uuid
-import pandas as pd
 import io
-from flask import Flask, render_template, request, jsonify, send_file
+from collections import defaultdict, deque
+from operator import itemgetter
+from openpyxl import Workbook
+from flask import Flask, render_template, request, send_file, Response
+from markupsafe import escape
 from datetime import datetime, timedelta
 
 app = Flask(__name__)
 
+def json_response(obj):
+    """
+    Serialize obj with orjson, which is several times faster than the
+    stdlib json module behind Flask's jsonify.
+    """
+    return Response(orjson.dumps(obj), mimetype='application/json')
+
+def request_json():
+    """
+    Parse the request body with orjson; request.json goes through the
+    stdlib decoder and caches the result on the request, neither of which
+    these read-a-few-keys endpoints need.
+    """
+    body = request.get_data(cache=False)
+    return orjson.loads(body) if body else {}
+
 # In-memory data store
 attendance_records = {}
+attendance_ids = {}  # date -> set of studentIds, for O(1) duplicate checks
 valid_qr_codes = {}
-scan_history = {}  # Track scan attempts by IP/device
+qr_expiry_heap = []  # (monotonic deadline, qr_id), oldest first
+current_qr_by_key = {}  # (class_name, classroom, time_slot, day) -> live qr_id
+scan_history = defaultdict(deque)  # IP -> deque of monotonic scan timestamps
 timetables = {}  # Store timetables
 classes = {}  # Store class information
+classes_by_tt = defaultdict(set)  # timetable_id -> class ids, kept in step with classes
+_xlsx_cache = {}  # (date, record count) -> serialized workbook bytes
+
+# Export column order; itemgetter pulls a whole row in one C call
+EXPORT_FIELDS = ('time', 'studentId', 'studentName', 'status', 'method')
+_export_row = itemgetter(*EXPORT_FIELDS)
+
+# Write-behind persistence: mutations mark a file dirty and return
+# immediately; a daemon thread coalesces bursts into one atomic write.
+_persist_event = threading.Event()
+_persist_lock = threading.Lock()
+_dirty_files = set()
+
+def _mark_dirty(filename):
+    with _persist_lock:
+        _dirty_files.add(filename)
+    _persist_event.set()
+
+def _write_json_atomic(filename, obj):
+    tmp_path = filename + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, filename)
+    except Exception as e:
+        print(f"Error saving to {filename}: {e}")
+
+def _persist_worker():
+    while True:
+        _persist_event.wait()
+        time.sleep(0.5)  # let a burst of edits coalesce into one write
+        _persist_event.clear()
+        with _persist_lock:
+            pending = _dirty_files.copy()
+            _dirty_files.clear()
+        for filename in pending:
+            data = timetables if filename == 'timetables.json' else classes
+            _write_json_atomic(filename, data)
+
+threading.Thread(target=_persist_worker, daemon=True).start()
+
+# Past days' records are archived to disk so the in-memory store only
+# ever holds today's attendance.
+ATTENDANCE_ARCHIVE_DIR = 'attendance'
+
+def _archive_old_attendance():
+    """
+    Flush every date except today to attendance/YYYY-MM-DD.json.gz and
+    drop it from memory.
+    """
+    today = get_current_date()
+    for day in [d for d in attendance_records if d != today]:
+        records = attendance_records.pop(day)
+        attendance_ids.pop(day, None)
+        try:
+            os.makedirs(ATTENDANCE_ARCHIVE_DIR, exist_ok=True)
+            archive_path = os.path.join(ATTENDANCE_ARCHIVE_DIR, f'{day}.json.gz')
+            with gzip.open(archive_path, 'wb') as f:
+                f.write(orjson.dumps(records))
+        except Exception as e:
+            print(f"Error archiving attendance for {day}: {e}")
+
+def _archive_worker():
+    while True:
+        # Sleep until 00:05 local time, then archive yesterday's records
+        now = datetime.now()
+        next_run = (now + timedelta(days=1)).replace(
+            hour=0, minute=5, second=0, microsecond=0)
+        time.sleep((next_run - now).total_seconds())
+        _archive_old_attendance()
+
+threading.Thread(target=_archive_worker, daemon=True).start()
+
+_date_cache = [None, ""]  # [(year, yday) bucket, formatted date]
 
 def get_current_date():
-    return datetime.now().strftime('%Y-%m-%d')
+    """
+    Return today's date as YYYY-MM-DD, re-running strftime only when the
+    day actually changes.
+    """
+    now = time.localtime()
+    bucket = (now.tm_year, now.tm_yday)
+    if _date_cache[0] != bucket:
+        _date_cache[0] = bucket
+        _date_cache[1] = time.strftime('%Y-%m-%d', now)
+    return _date_cache[1]
+
+SCAN_WINDOW_SECONDS = 30 * 60
+QR_TTL_SECONDS = 30 * 60
+
+# Redis keeps the rate-limit window shared across gunicorn workers/hosts;
+# if it is unreachable we fall back to the per-process deque history.
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# Evict old scans and report the window state atomically.
+# ARGV[1] = now in ms, ARGV[2] = window length in ms.
+_SCAN_WINDOW_LUA = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, ARGV[1] - ARGV[2])
+local count = redis.call('ZCARD', KEYS[1])
+if count == 0 then return {0, false} end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {count, oldest[2]}
+"""
+
+_redis_client = None
+_scan_window_script = None
+
+def _get_redis():
+    global _redis_client, _scan_window_script
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            REDIS_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+        _scan_window_script = _redis_client.register_script(_SCAN_WINDOW_LUA)
+    return _redis_client
+
+# Slot boundaries in minutes from midnight: 8:30-9:30, 9:30-10:30,
+# 10:45-11:45 (after tea break), 11:45-12:45, 1:30-2:30 (after lunch),
+# 2:30-3:30, 3:30-4:30, 4:30-5:30
+_SLOT_STARTS = (510, 570, 645, 705, 810, 870, 930, 990)
+_SLOT_ENDS = (570, 630, 705, 765, 870, 930, 990, 1050)
+
+def _expire_qrs():
+    """
+    Drop QR codes whose deadline has passed. Amortized O(log n) per call,
+    and keeps valid_qr_codes from growing without bound.
+    """
+    now = time.monotonic()
+    while qr_expiry_heap and qr_expiry_heap[0][0] < now:
+        _, qr_id = heapq.heappop(qr_expiry_heap)
+        valid_qr_codes.pop(qr_id, None)
+
+def _store_qr(qr_data):
+    """
+    Register a freshly generated QR code, mirroring it into Redis (with a
+    server-side TTL) so every worker accepts it.
+    """
+    qr_id = qr_data['id']
+    valid_qr_codes[qr_id] = qr_data
+    heapq.heappush(qr_expiry_heap, (time.monotonic() + QR_TTL_SECONDS, qr_id))
+    try:
+        r = _get_redis()
+        pipe = r.pipeline()
+        pipe.hset(f'qr:{qr_id}', mapping=qr_data)
+        pipe.expire(f'qr:{qr_id}', QR_TTL_SECONDS)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+def _qr_is_valid(qr_id):
+    """
+    True if the QR code exists and has not expired. Redis answers with a
+    plain EXISTS (the TTL does the expiry); without Redis we check the
+    local dict and epoch expiry.
+    """
+    try:
+        return bool(_get_redis().exists(f'qr:{qr_id}'))
+    except redis.RedisError:
+        pass
+    qr_data = valid_qr_codes.get(qr_id)
+    if qr_data is None:
+        return False
+    if qr_data['expiry_ts'] < time.time():
+        valid_qr_codes.pop(qr_id, None)
+        return False
+    return True
+
+def _try_mark_attendance(today, student_id):
+    """
+    Atomically claim student_id for today's attendance. Returns False if
+    the student is already marked. Redis SADD makes the claim correct
+    across workers; the local set is kept in step either way.
+    """
+    try:
+        r = _get_redis()
+        pipe = r.pipeline()
+        pipe.sadd(f'attendance:{today}', student_id)
+        pipe.expire(f'attendance:{today}', 172800)
+        added, _ = pipe.execute()
+        if not added:
+            return False
+        attendance_ids.setdefault(today, set()).add(student_id)
+        return True
+    except redis.RedisError:
+        pass
+    ids = attendance_ids.setdefault(today, set())
+    if student_id in ids:
+        return False
+    ids.add(student_id)
+    return True
+
+def _next_allowed_time(oldest_scan):
+    """
+    Convert a monotonic scan timestamp into the wall-clock datetime when
+    the next scan becomes allowed.
+    """
+    seconds_left = oldest_scan + SCAN_WINDOW_SECONDS - time.monotonic()
+    return datetime.now() + timedelta(seconds=seconds_left)
+
+def _scan_window_state(client_ip):
+    """
+    Return (scan_count, next_allowed_datetime) for the client's current
+    30-minute window, shared across workers via Redis when available.
+    """
+    try:
+        _get_redis()
+        now_ms = int(time.time() * 1000)
+        count, oldest = _scan_window_script(
+            keys=[f'scanlimit:{client_ip}'],
+            args=[now_ms, SCAN_WINDOW_SECONDS * 1000])
+        if count == 0:
+            return 0, None
+        next_allowed = datetime.fromtimestamp(
+            (float(oldest) + SCAN_WINDOW_SECONDS * 1000) / 1000)
+        return count, next_allowed
+    except redis.RedisError:
+        pass
+
+    # Per-process fallback
+    scans = scan_history[client_ip]
+    cutoff = time.monotonic() - SCAN_WINDOW_SECONDS
+    while scans and scans[0] <= cutoff:
+        scans.popleft()
+    if not scans:
+        return 0, None
+    return len(scans), _next_allowed_time(scans[0])
 
 def check_scan_limit(client_ip):
     """
     Check if the client IP has exceeded scan limits (1 scan per 30 minutes)
     """
-    current_time = datetime.now()
-    
-
-    if client_ip not in scan_history:
-        scan_history[client_ip] = []
-    
-    # Remove scans older than 30 minutes
-    cutoff_time = current_time - timedelta(minutes=30)
-    scan_history[client_ip] = [
-        scan_time for scan_time in scan_history[client_ip] 
-        if scan_time > cutoff_time
-    ]
-    
-    # Check if user has already made 1 scan in the last 30 minutes
-    if len(scan_history[client_ip]) >= 1:
-        next_allowed_time = scan_history[client_ip][0] + timedelta(minutes=30)
+    count, next_allowed_time = _scan_window_state(client_ip)
+    if count >= 1:
         return False, f"You can only scan 1 QR code per 30 minutes. Next scan allowed at: {next_allowed_time.strftime('%H:%M:%S')}"
-    
+
     return True, ""
 
 def record_scan_attempt(client_ip):
     """
     Record a successful scan attempt
     """
-    current_time = datetime.now()
-    if client_ip not in scan_history:
-        scan_history[client_ip] = []
-    scan_history[client_ip].append(current_time)
+    try:
+        r = _get_redis()
+        now_ms = int(time.time() * 1000)
+        pipe = r.pipeline()
+        pipe.zadd(f'scanlimit:{client_ip}', {str(now_ms): now_ms})
+        pipe.expire(f'scanlimit:{client_ip}', SCAN_WINDOW_SECONDS)
+        pipe.execute()
+    except redis.RedisError:
+        scan_history[client_ip].append(time.monotonic())
 
 @app.route('/')
 def home():
@@ -62,78 +306,104 @@ def generate_qr():
     Generates a QR code URL for attendance marking and stores it as valid.
     """
     try:
-        data = request.json or {}
-        
+        _expire_qrs()
+        data = request_json()
+
+        class_name = data.get("class_name", "Computer Science 101")
+        classroom = data.get("classroom", "Room 205")
+        time_slot = data.get("time_slot", "")
+        day = data.get("day", "")
+
+        # Generate QR code URL (replace with your server address as needed)
+        server_url = request.host_url.rstrip('/')
+
+        # Dashboard refreshes re-request the same class; hand back the
+        # live code until it is within 5 minutes of expiring
+        key = (class_name, classroom, time_slot, day)
+        existing = valid_qr_codes.get(current_qr_by_key.get(key))
+        if existing is not None and existing['expiry_ts'] - time.time() > 300:
+            qr_url = f"{server_url}/attend?qrId={existing['id']}"
+            return json_response({"qr_data": existing, "qr_url": qr_url})
+
         qr_id = str(uuid.uuid4())
         qr_data = {
             "id": qr_id,
-            "class_name": data.get("class_name", "Computer Science 101"),
-            "classroom": data.get("classroom", "Room 205"),
+            "class_name": class_name,
+            "classroom": classroom,
             "instructor": data.get("instructor", "Dr. Smith"),
             "subject": data.get("subject", ""),
-            "time_slot": data.get("time_slot", ""),
-            "day": data.get("day", ""),
+            "time_slot": time_slot,
+            "day": day,
             "timetable_id": data.get("timetable_id", ""),
             "timestamp": datetime.now().isoformat(),
             "expiry": (datetime.now() + timedelta(minutes=30)).isoformat(),
+            "expiry_ts": time.time() + QR_TTL_SECONDS,
         }
-        valid_qr_codes[qr_id] = qr_data
-        # Generate QR code URL (replace with your server address as needed)
-        server_url = request.host_url.rstrip('/')
+        _store_qr(qr_data)
+        current_qr_by_key[key] = qr_id
         qr_url = f"{server_url}/attend?qrId={qr_id}"
-        return jsonify({"qr_data": qr_data, "qr_url": qr_url})
+        return json_response({"qr_data": qr_data, "qr_url": qr_url})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
+_attend_form_cache = None  # rendered form with a placeholder for qr_id
+
 @app.route('/attend', methods=['GET', 'POST'])
 def attend_form():
     """
     Web form for students to enter USN ID and name after scanning QR code.
     """
+    global _attend_form_cache
     qr_id = request.args.get('qrId')
     error = None
     success = None
     client_ip = request.remote_addr
-    
+    _expire_qrs()
+
+    if request.method == 'GET':
+        # The page only varies by qr_id, so render Jinja once and
+        # substitute the (escaped) id into the cached markup
+        if _attend_form_cache is None:
+            _attend_form_cache = render_template(
+                'attend_form.html', qr_id='__QRID__', error=None, success=None)
+        page = _attend_form_cache.replace('__QRID__', str(escape(qr_id or '')))
+        return Response(page, mimetype='text/html')
+
     if request.method == 'POST':
-        # Check scan limit before processing
-        can_scan, limit_message = check_scan_limit(client_ip)
-        if not can_scan:
-            error = limit_message
+        # Cheapest rejections first: QR validity, then scan limit, and only
+        # then parse the form body
+        if not qr_id or not _qr_is_valid(qr_id):
+            error = "Invalid or expired QR code."
         else:
-            student_id = request.form.get('studentId')
-            student_name = request.form.get('studentName')
-            
-            if not student_id or not student_name:
-                error = "Please enter both USN ID and Name."
-            elif qr_id not in valid_qr_codes:
-                error = "Invalid or expired QR code."
+            can_scan, limit_message = check_scan_limit(client_ip)
+            if not can_scan:
+                error = limit_message
             else:
-                # Check QR code expiry
-                qr_data = valid_qr_codes[qr_id]
-                if datetime.fromisoformat(qr_data['expiry']) < datetime.now():
-                    del valid_qr_codes[qr_id]
-                    error = "QR code has expired."
+                student_id = request.form.get('studentId')
+                student_name = request.form.get('studentName')
+
+                if not student_id or not student_name:
+                    error = "Please enter both USN ID and Name."
                 else:
                     # Mark attendance
                     today = get_current_date()
                     if today not in attendance_records:
                         attendance_records[today] = []
-                    
-                    if any(record['studentId'] == student_id for record in attendance_records[today]):
+
+                    if not _try_mark_attendance(today, student_id):
                         error = "Attendance already marked for this USN today."
                     else:
                         new_record = {
-                            "time": datetime.now().strftime('%H:%M:%S'),
+                            "time": time.strftime('%H:%M:%S'),
                             "studentId": student_id,
                             "studentName": student_name,
                             "status": "Present",
                             "method": "qr"
                         }
                         attendance_records[today].append(new_record)
-                        
+
                         # Record the successful scan attempt
                         record_scan_attempt(client_ip)
-                        
+
                         success = "Attendance recorded successfully!"
     
     return render_template('attend_form.html', qr_id=qr_id, error=error, success=success)
@@ -145,14 +415,14 @@ def check_scan_limit_api():
     """
     client_ip = request.remote_addr
     can_scan, message = check_scan_limit(client_ip)
-    
-    remaining_scans = 1 - len(scan_history.get(client_ip, []))
-    
-    return jsonify({
+
+    count, next_allowed_time = _scan_window_state(client_ip)
+
+    return json_response({
         "can_scan": can_scan,
         "message": message,
-        "remaining_scans": remaining_scans,
-        "reset_time": (scan_history[client_ip][0] + timedelta(minutes=30)).isoformat() if scan_history.get(client_ip) else None
+        "remaining_scans": 1 - count,
+        "reset_time": next_allowed_time.isoformat() if next_allowed_time else None
     })
 
 @app.route('/api/timetables', methods=['GET'])
@@ -160,7 +430,7 @@ def get_timetables():
     """
     Get all timetables
     """
-    return jsonify(timetables)
+    return json_response(timetables)
 
 @app.route('/api/current_class', methods=['POST'])
 def get_current_class():
@@ -168,11 +438,11 @@ def get_current_class():
     Get the current class from a timetable based on current time and day
     """
     try:
-        data = request.json
+        data = request_json()
         timetable_id = data.get('timetable_id')
         
         if not timetable_id or timetable_id not in timetables:
-            return jsonify({"error": "Timetable not found"}), 404
+            return json_response({"error": "Timetable not found"}), 404
         
         timetable = timetables[timetable_id]
         current_time = datetime.now()
@@ -181,27 +451,14 @@ def get_current_class():
         current_minute = current_time.minute
         current_time_minutes = current_hour * 60 + current_minute
         
-        # Define time slots (in minutes from midnight)
-        time_slots = [
-            {"start": 8*60 + 30, "end": 9*60 + 30, "slot": 0},    # 8:30-9:30
-            {"start": 9*60 + 30, "end": 10*60 + 30, "slot": 1},   # 9:30-10:30
-            {"start": 10*60 + 45, "end": 11*60 + 45, "slot": 2},  # 10:45-11:45 (after tea break)
-            {"start": 11*60 + 45, "end": 12*60 + 45, "slot": 3},  # 11:45-12:45
-            {"start": 13*60 + 30, "end": 14*60 + 30, "slot": 4},  # 1:30-2:30 (after lunch)
-            {"start": 14*60 + 30, "end": 15*60 + 30, "slot": 5},  # 2:30-3:30
-            {"start": 15*60 + 30, "end": 16*60 + 30, "slot": 6},  # 3:30-4:30
-            {"start": 16*60 + 30, "end": 17*60 + 30, "slot": 7},  # 4:30-5:30
-        ]
-        
-        # Find current time slot
+        # Find current time slot: bisect the sorted starts, then one bound check
         current_slot = None
-        for slot_info in time_slots:
-            if slot_info["start"] <= current_time_minutes <= slot_info["end"]:
-                current_slot = slot_info["slot"]
-                break
-        
+        i = bisect_right(_SLOT_STARTS, current_time_minutes) - 1
+        if 0 <= i < len(_SLOT_STARTS) and current_time_minutes <= _SLOT_ENDS[i]:
+            current_slot = i
+
         if current_slot is None:
-            return jsonify({"message": "No class at current time", "is_break": True})
+            return json_response({"message": "No class at current time", "is_break": True})
         
         # Check if there's a class scheduled
         if current_day in timetable.get('schedule', {}):
@@ -209,7 +466,7 @@ def get_current_class():
             if current_slot < len(day_schedule):
                 class_info = day_schedule[current_slot]
                 if class_info.get('subject'):
-                    return jsonify({
+                    return json_response({
                         "class_info": class_info,
                         "day": current_day,
                         "slot": current_slot,
@@ -218,10 +475,10 @@ def get_current_class():
                         "is_break": False
                     })
         
-        return jsonify({"message": "No class scheduled at current time", "is_break": False})
+        return json_response({"message": "No class scheduled at current time", "is_break": False})
         
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/api/timetables', methods=['POST'])
 def save_timetable():
@@ -229,24 +486,19 @@ def save_timetable():
     Save a timetable
     """
     try:
-        data = request.json
+        data = request_json()
         timetable_id = data.get('id')
         if not timetable_id:
-            return jsonify({"error": "Timetable ID is required"}), 400
+            return json_response({"error": "Timetable ID is required"}), 400
         
         timetables[timetable_id] = data
-        
-        # Also save to a JSON file for persistence
-        import json
-        try:
-            with open('timetables.json', 'w') as f:
-                json.dump(timetables, f, indent=2)
-        except Exception as e:
-            print(f"Error saving to file: {e}")
-        
-        return jsonify({"message": "Timetable saved successfully"})
+
+        # Persist off the request thread
+        _mark_dirty('timetables.json')
+
+        return json_response({"message": "Timetable saved successfully"})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/api/timetables/<timetable_id>', methods=['DELETE'])
 def delete_timetable(timetable_id):
@@ -256,30 +508,40 @@ def delete_timetable(timetable_id):
     try:
         if timetable_id in timetables:
             del timetables[timetable_id]
-            
-            # Save to file
-            import json
-            try:
-                with open('timetables.json', 'w') as f:
-                    json.dump(timetables, f, indent=2)
-            except Exception as e:
-                print(f"Error saving to file: {e}")
-            
-            return jsonify({"message": "Timetable deleted successfully"})
+
+            # Persist off the request thread
+            _mark_dirty('timetables.json')
+
+            return json_response({"message": "Timetable deleted successfully"})
         else:
-            return jsonify({"error": "Timetable not found"}), 404
+            return json_response({"error": "Timetable not found"}), 404
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
+
+def _load_json_mmap(filename):
+    """
+    Parse a JSON file through a read-only mmap; orjson accepts the buffer
+    directly, so the contents are never copied into an intermediate bytes
+    object.
+    """
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {}
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(mm)
+        try:
+            return orjson.loads(buf)
+        finally:
+            buf.release()
+            mm.close()
 
 def load_timetables_from_file():
     """
     Load timetables from JSON file on startup
     """
     global timetables
-    import json
     try:
-        with open('timetables.json', 'r') as f:
-            timetables = json.load(f)
+        timetables = _load_json_mmap('timetables.json')
         print(f"Loaded {len(timetables)} timetables from file")
     except FileNotFoundError:
         print("No timetables file found, starting with empty timetables")
@@ -293,10 +555,8 @@ def load_classes_from_file():
     Load classes from JSON file on startup
     """
     global classes
-    import json
     try:
-        with open('classes.json', 'r') as f:
-            classes = json.load(f)
+        classes = _load_json_mmap('classes.json')
         print(f"Loaded {len(classes)} classes from file")
     except FileNotFoundError:
         print("No classes file found, starting with empty classes")
@@ -305,12 +565,17 @@ def load_classes_from_file():
         print(f"Error loading classes: {e}")
         classes = {}
 
+    classes_by_tt.clear()
+    for class_id, data in classes.items():
+        if data.get('timetable_id'):
+            classes_by_tt[data['timetable_id']].add(class_id)
+
 @app.route('/api/classes', methods=['GET'])
 def get_classes():
     """
     Get all classes
     """
-    return jsonify(classes)
+    return json_response(classes)
 
 @app.route('/api/classes', methods=['POST'])
 def save_class():
@@ -318,24 +583,25 @@ def save_class():
     Save a class
     """
     try:
-        data = request.json
+        data = request_json()
         class_id = data.get('id')
         if not class_id:
-            return jsonify({"error": "Class ID is required"}), 400
+            return json_response({"error": "Class ID is required"}), 400
         
+        # Keep the reverse index in step, including timetable reassignment
+        old = classes.get(class_id)
+        if old is not None and old.get('timetable_id'):
+            classes_by_tt[old['timetable_id']].discard(class_id)
         classes[class_id] = data
-        
-        # Also save to a JSON file for persistence
-        import json
-        try:
-            with open('classes.json', 'w') as f:
-                json.dump(classes, f, indent=2)
-        except Exception as e:
-            print(f"Error saving classes to file: {e}")
-        
-        return jsonify({"message": "Class saved successfully"})
+        if data.get('timetable_id'):
+            classes_by_tt[data['timetable_id']].add(class_id)
+
+        # Persist off the request thread
+        _mark_dirty('classes.json')
+
+        return json_response({"message": "Class saved successfully"})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/api/classes/<class_id>', methods=['DELETE'])
 def delete_class(class_id):
@@ -344,21 +610,18 @@ def delete_class(class_id):
     """
     try:
         if class_id in classes:
-            del classes[class_id]
-            
-            # Save to file
-            import json
-            try:
-                with open('classes.json', 'w') as f:
-                    json.dump(classes, f, indent=2)
-            except Exception as e:
-                print(f"Error saving classes to file: {e}")
-            
-            return jsonify({"message": "Class deleted successfully"})
+            removed = classes.pop(class_id)
+            if removed.get('timetable_id'):
+                classes_by_tt[removed['timetable_id']].discard(class_id)
+
+            # Persist off the request thread
+            _mark_dirty('classes.json')
+
+            return json_response({"message": "Class deleted successfully"})
         else:
-            return jsonify({"error": "Class not found"}), 404
+            return json_response({"error": "Class not found"}), 404
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/api/classes/timetable/<timetable_id>', methods=['GET'])
 def get_classes_for_timetable(timetable_id):
@@ -366,10 +629,10 @@ def get_classes_for_timetable(timetable_id):
     Get all classes associated with a specific timetable
     """
     try:
-        timetable_classes = {k: v for k, v in classes.items() if v.get('timetable_id') == timetable_id}
-        return jsonify(timetable_classes)
+        timetable_classes = {cid: classes[cid] for cid in classes_by_tt.get(timetable_id, ())}
+        return json_response(timetable_classes)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/api/attend', methods=['POST'])
 def record_attendance():
@@ -377,35 +640,31 @@ def record_attendance():
     Records a student's attendance. Validates QR code data if provided.
     """
     try:
-        data = request.json
+        _expire_qrs()
+        data = request_json()
         student_id = data.get('studentId')
         student_name = data.get('studentName')
         method = data.get('method')
         qr_id = data.get('qrId')
 
         if not student_id or not student_name or not method:
-            return jsonify({"error": "Missing student information"}), 400
+            return json_response({"error": "Missing student information"}), 400
+
+        # QR code validation (before the attendance claim, which mutates)
+        if method == 'qr' and qr_id:
+            if not _qr_is_valid(qr_id):
+                return json_response({"error": "Invalid or expired QR code."}), 403
 
-        # Check for duplicate entry for today's date and student ID
+        # Atomically claim today's attendance for this student ID
         today = get_current_date()
         if today not in attendance_records:
             attendance_records[today] = []
 
-        if any(record['studentId'] == student_id for record in attendance_records[today]):
-            return jsonify({"error": "Student already marked present today."}), 409
-
-        # QR code validation
-        if method == 'qr' and qr_id:
-            if qr_id not in valid_qr_codes:
-                return jsonify({"error": "Invalid QR code."}), 403
-            
-            qr_data = valid_qr_codes[qr_id]
-            if datetime.fromisoformat(qr_data['expiry']) < datetime.now():
-                del valid_qr_codes[qr_id]
-                return jsonify({"error": "QR code has expired."}), 403
+        if not _try_mark_attendance(today, student_id):
+            return json_response({"error": "Student already marked present today."}), 409
 
         new_record = {
-            "time": datetime.now().strftime('%H:%M:%S'),
+            "time": time.strftime('%H:%M:%S'),
             "studentId": student_id,
             "studentName": student_name,
             "status": "Present",
@@ -413,11 +672,11 @@ def record_attendance():
         }
 
         attendance_records[today].append(new_record)
-        
-        return jsonify({"message": "Attendance recorded successfully!", "record": new_record})
+
+        return json_response({"message": "Attendance recorded successfully!", "record": new_record})
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/api/attendance', methods=['GET'])
 def get_attendance():
@@ -425,7 +684,7 @@ def get_attendance():
     Retrieves all attendance records for today.
     """
     today = get_current_date()
-    return jsonify(attendance_records.get(today, []))
+    return json_response(attendance_records.get(today, []))
 
 @app.route('/api/export_excel', methods=['GET'])
 def export_excel():
@@ -436,18 +695,46 @@ def export_excel():
     data = attendance_records.get(today, [])
 
     if not data:
-        return jsonify({"error": "No attendance data to export."}), 404
+        return json_response({"error": "No attendance data to export."}), 404
+
+    # CSV is much cheaper to produce than a workbook, so offer it directly
+    if request.args.get('format') == 'csv':
+        output = io.BytesIO()
+        text_wrapper = io.TextIOWrapper(io.BufferedWriter(output), newline='', encoding='utf-8')
+        writer = csv.DictWriter(text_wrapper, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(data)
+        text_wrapper.flush()
+        text_wrapper.detach().detach()  # unwrap without closing the BytesIO
+        output.seek(0)
+        return send_file(
+            output,
+            mimetype="text/csv",
+            as_attachment=True,
+            download_name=f"Attendance_Report_{today}.csv"
+        )
+
+    # Appends only ever grow the day's list, so (date, length) uniquely
+    # identifies the workbook contents and makes a safe cache key
+    cache_key = (today, len(data))
+    xlsx_bytes = _xlsx_cache.get(cache_key)
+    if xlsx_bytes is None:
+        # Stream the workbook row by row instead of building a DataFrame first
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Attendance')
+        ws.append(EXPORT_FIELDS)
+        for record in data:
+            ws.append(_export_row(record))
+
+        output = io.BytesIO()
+        wb.save(output)
+        xlsx_bytes = output.getvalue()
+        # Single entry keeps memory bounded; stale keys never match again
+        _xlsx_cache.clear()
+        _xlsx_cache[cache_key] = xlsx_bytes
 
-    df = pd.DataFrame(data)
-    
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name='Attendance', index=False)
-    
-    output.seek(0)
-    
     return send_file(
-        output,
+        io.BytesIO(xlsx_bytes),
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         as_attachment=True,
         download_name=f"Attendance_Report_{today}.xlsx"
@@ -0,0 +1,11 @@
+# wsgi.py
+# Production entry point. The Flask dev server in main.py handles one
+# request at a time, so a slow download stalls every other client; run
+# this module under gunicorn instead:
+#
+#   gunicorn -k gevent -w 4 -b 0.0.0.0:5000 wsgi:app
+#
+from main import app, load_timetables_from_file, load_classes_from_file
+
+load_timetables_from_file()
+load_classes_from_file()